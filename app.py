@@ -1,230 +1,467 @@
 import asyncio
-import json
-import secrets
+import base64
+import contextlib
+import gzip
+import struct
 import os
+import re
 import http
+import shutil
+import tempfile
+import multiprocessing
+import signal
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Annotated
 
-from websockets.asyncio.server import serve
-from websockets import broadcast as ws_broadcast
+import brotli
+import msgspec
+import uvloop
+from websockets.asyncio.client import unix_connect
+from websockets.asyncio.server import serve, unix_serve
+from websockets.exceptions import ConnectionClosed, ConnectionClosedOK
 from websockets.http import Headers
 from websockets.server import Response
 from connect4 import PLAYER1, PLAYER2, Connect4
 
 import logging
 
-JOIN = {}
-WATCH = {}
+# Events sent to the browser are binary frames starting with a one-byte tag.
+# Moves and wins are packed as tag, player, column, row; errors and the init
+# event carry a JSON object after the tag.
+TAG_PLAY, TAG_WIN, TAG_ERROR, TAG_INIT = 1, 2, 3, 4
+PLAYER_CODES = {PLAYER1: 1, PLAYER2: 2}
+_EVENT = struct.Struct("<BBBB")
 
-async def error(websocket, message):
-    event = {
-        "type": "error",
-        "message": message,
-    }
-    await websocket.send(json.dumps(event))
-
-async def join(websocket, join_key):
-    # Find the Connect Four game.
+# There are only 2 x 7 x 6 possible moves, so every play frame is packed once
+# here and looked up with _PLAY_FRAMES[player][column][row].
+_PLAY_FRAMES = {
+    player: [
+        [_EVENT.pack(TAG_PLAY, code, column, row) for row in range(6)]
+        for column in range(7)
+    ]
+    for player, code in PLAYER_CODES.items()
+}
+
+# Likewise for the two possible win frames.
+_WIN_FRAMES = {
+    player: _EVENT.pack(TAG_WIN, code, 0, 0)
+    for player, code in PLAYER_CODES.items()
+}
+
+
+# JSON messages have a fixed shape per "type", so they are declared as msgspec
+# structs and go through one encoder and one decoder built at import time.
+class InitCommand(msgspec.Struct, tag_field="type", tag="init"):
+    join: str | None = None
+    watch: str | None = None
+
+
+class PlayCommand(msgspec.Struct, tag_field="type", tag="play"):
+    column: Annotated[int, msgspec.Meta(ge=0, le=6)]
+
+
+class ErrorEvent(msgspec.Struct, tag_field="type", tag="error"):
+    message: str
+
+
+_ENCODER = msgspec.json.Encoder()
+_DECODER = msgspec.json.Decoder(InitCommand | PlayCommand)
+
+# main.js always sends moves as exactly this prefix, one digit and "}".
+_PLAY_PREFIX = b'{"type":"play","column":'
+_PLAY_LENGTH = len(_PLAY_PREFIX) + 2
+
+
+def _parse_play(message):
+    # Return the column of a play command in the exact form main.js sends,
+    # or None if the message needs to go through the JSON decoder. Messages
+    # are raw bytes, so indexing yields byte values.
+    if (
+        len(message) == _PLAY_LENGTH
+        and message.startswith(_PLAY_PREFIX)
+        and message.endswith(b"}")
+        and message[-2] in b"0123456"
+    ):
+        return message[-2] - 48  # ord("0")
+    return None
+
+
+@dataclass
+class GameRoom:
+    """A Connect Four game and the outbound queues of the connections receiving its moves"""
+    game: Connect4
+    # Slot i holds a connection's queue and alive[i] tells whether it is still
+    # subscribed. Slots of closed connections are reused through free.
+    queues: list = field(default_factory=list)
+    alive: bytearray = field(default_factory=bytearray)
+    free: list = field(default_factory=list)
+
+
+# Access tokens map to (room, role): the join key lets a second player in,
+# the watch key lets spectators in.
+ROLE_PLAYER, ROLE_SPECTATOR = 1, 2
+ROOMS = {}
+
+# The server runs in WORKERS processes sharing the port with SO_REUSEPORT.
+# Games live in the memory of the process that started them, identified by
+# WORKER_ID, which is set when the process starts. Tokens name the owner in
+# two hex digits, hence at most 256 workers. Each worker also listens on a
+# Unix socket in SOCKET_DIR so that the others can hand connections over.
+WORKERS = min(int(os.environ.get("WEB_CONCURRENCY") or os.cpu_count() or 1), 256)
+WORKER_ID = 0
+SOCKET_DIR = None
+
+# Frames buffered per connection; a slow reader loses the oldest ones first.
+QUEUE_SIZE = 64
+
+async def writer(websocket, queue):
+    # Send queued frames one at a time until the connection closes.
     try:
-        game, connected = JOIN[join_key]
-    except KeyError:
-        await error(websocket, "Game not found")
-        return
+        while True:
+            frame = await queue.get()
+            await websocket.send(frame)
+    except ConnectionClosed:
+        pass
 
-    # Register to receive moves from this game
-    connected.add(websocket)
+@contextlib.asynccontextmanager
+async def subscribe(websocket, room):
+    # Register a connection to receive moves from the room. Frames go through
+    # a bounded queue drained by a dedicated task, so a slow connection never
+    # holds up the others.
+    queue = asyncio.Queue(QUEUE_SIZE)
+    task = asyncio.create_task(writer(websocket, queue))
+    if room.free:
+        slot = room.free.pop()
+        room.queues[slot] = queue
+        room.alive[slot] = 1
+    else:
+        slot = len(room.queues)
+        room.queues.append(queue)
+        room.alive.append(1)
     try:
+        yield
+    finally:
+        room.alive[slot] = 0
+        room.free.append(slot)
+        task.cancel()
+
+def broadcast(room, frame):
+    # Queue an already encoded frame for every connection in the room.
+    for queue, alive in zip(room.queues, room.alive):
+        if not alive:
+            continue
+        try:
+            queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            # Drop the oldest frame to make room.
+            queue.get_nowait()
+            queue.put_nowait(frame)
+
+def _error_frame(message):
+    return bytes([TAG_ERROR]) + _ENCODER.encode(ErrorEvent(message))
+
+# Errors with a fixed message, including the ones raised by Connect4.play(),
+# are encoded once.
+_ERROR_FRAMES = {
+    message: _error_frame(message)
+    for message in [
+        "Game not found",
+        "Invalid message.",
+        "It isn't your turn.",
+        "This slot is full.",
+    ]
+}
+
+async def error(websocket, message):
+    frame = _ERROR_FRAMES.get(message)
+    if frame is None:
+        frame = _error_frame(message)
+    await websocket.send(frame)
+
+async def join(websocket, room):
+    # Register to receive moves from this game
+    async with subscribe(websocket, room):
         # Send the first move, in case the first player already played it.
-        await replay(websocket, game)
+        await replay(websocket, room.game)
         # Receive and process moves from the second player.
-        await play(websocket, game, PLAYER2, connected)
-
-    finally:
-        connected.remove(websocket)
+        await play(websocket, room, PLAYER2)
 
 async def replay(websocket, game):
-    # Make a copy to avoid an exception if game.moves changes while iteration
-    # is in progress. If a move is played while replay is running, moves will
-    # be sent out of order but each move will be sent once and eventually the
-    # UI will be consistent.
-    for player, column, row in game.moves.copy():
-        event = {
-            "type": "play",
-            "player": player,
-            "column": column,
-            "row": row,
-        }
-        await websocket.send(json.dumps(event))
-
-async def watch(websocket, watch_key):
-    # Find the Connect Four game.
-    try:
-        game, connected = JOIN[watch_key]
-    except KeyError:
-        await error(websocket, "Game not found")
-        return
+    # Send every past move in a single frame of concatenated play events.
+    # Callers replay right after subscribing, with no await in between, so
+    # each move is sent once: later moves reach the connection via its queue.
+    if game.moves:
+        await websocket.send(b"".join(
+            _PLAY_FRAMES[player][column][row]
+            for player, column, row in game.moves
+        ))
 
+async def watch(websocket, room):
     # Register to receive moves from this game
-    connected.add(websocket)
-    try:
+    async with subscribe(websocket, room):
         # Get game moves that have already happened
-        await replay(websocket, game)
+        await replay(websocket, room.game)
         # Wait until the websocket is closed
         await websocket.wait_closed()
 
-    finally:
-        connected.remove(websocket)
+_INIT_PREFIX = bytes([TAG_INIT]) + b'{"type":"init","join":"'
 
-async def start(websocket):
-    # Initialize a Connect Four game, the set of websocket connections receiving moves from the game
-    # and secret acces token or identifier
-    game = Connect4()
-    connected = {websocket}
+def _init_frame(join_key, watch_key):
+    # Tokens are URL-safe ASCII and never need JSON escaping, so the init
+    # event is assembled directly instead of going through the encoder.
+    return (
+        _INIT_PREFIX + join_key.encode("ascii")
+        + b'","watch":"' + watch_key.encode("ascii") + b'"}'
+    )
+
+def _token():
+    # Two hex digits naming the worker that owns the game, followed by the
+    # equivalent of secrets.token_urlsafe(12): 12 random bytes encode to 16
+    # URL-safe characters without padding.
+    return f"{WORKER_ID:02x}" + base64.urlsafe_b64encode(os.urandom(12)).decode("ascii")
 
-    join_key = secrets.token_urlsafe(12)
-    JOIN[join_key] = game, connected
+def _token_owner(token):
+    # Return the id of the other worker that issued a token, or None if no
+    # other worker did. Only an exact two-digit prefix counts.
+    if WORKERS == 1 or not re.fullmatch("[0-9a-f]{2}", token[:2]):
+        return None
+    owner = int(token[:2], 16)
+    if owner == WORKER_ID or owner >= WORKERS:
+        return None
+    return owner
 
-    watch_key = secrets.token_urlsafe(12)
-    JOIN[watch_key] = game, connected
+def _worker_socket(worker_id):
+    return os.path.join(SOCKET_DIR, f"worker-{worker_id}.sock")
+
+async def pipe(source, target):
+    # Pass messages from one connection to the other; text stays text and
+    # binary stays binary.
+    try:
+        async for message in source:
+            await target.send(message)
+    except ConnectionClosed:
+        pass
+
+async def relay(websocket, owner, message):
+    # Hand the connection over to the worker that owns the game: connect to
+    # it, send it the init message and pass messages along in both directions
+    # until either side closes.
+    try:
+        upstream = await unix_connect(_worker_socket(owner), compression=None)
+    except OSError:
+        # The owner is gone, and its games with it.
+        await error(websocket, "Game not found")
+        return
+
+    async with upstream:
+        await upstream.send(message, text=True)
+        tasks = [
+            asyncio.create_task(pipe(websocket, upstream)),
+            asyncio.create_task(pipe(upstream, websocket)),
+        ]
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in tasks:
+            task.cancel()
+
+async def start(websocket):
+    # Initialize a Connect Four game and secret access tokens for joining and watching it
+    join_key = _token()
+    watch_key = _token()
+    room = GameRoom(Connect4())
+
+    ROOMS[join_key] = room, ROLE_PLAYER
+    ROOMS[watch_key] = room, ROLE_SPECTATOR
 
     try:
         # Send the secret access token to the browser of the first player,
         # where it'll be used for building a "join" link.
-        event = {
-            "type": "init",
-            "join": join_key,
-            "watch": watch_key,
-        }
-        await websocket.send(json.dumps(event))
+        await websocket.send(_init_frame(join_key, watch_key))
 
-        await play(websocket, game, PLAYER1, connected)
+        async with subscribe(websocket, room):
+            await play(websocket, room, PLAYER1)
 
     finally:
-        # Clean up both keys from JOIN (both are stored there)
-        if join_key in JOIN:
-            del JOIN[join_key]
-        if watch_key in JOIN:
-            del JOIN[watch_key]
-
-async def play(websocket, game, player, connected):
-    async for message in websocket:
+        del ROOMS[join_key]
+        del ROOMS[watch_key]
+
+async def play(websocket, room, player):
+    # This loop runs for every move, so everything it uses is bound to a
+    # local name once instead of being looked up on each iteration.
+    game = room.game
+    recv = websocket.recv
+    play_move = game.play
+    parse_play = _parse_play
+    decode = _DECODER.decode
+    fanout = broadcast
+    frames = _PLAY_FRAMES[player]
+    while True:
+        # Receive text frames as raw bytes: the parsers below work on bytes,
+        # so there is no point in decoding them to str first.
+        try:
+            message = await recv(decode=False)
+        except ConnectionClosedOK:
+            return
+
         # Parse play event from UI
-        event = json.loads(message)
-        assert event['type'] == 'play'
-        column = event['column']
+        column = parse_play(message)
+        if column is None:
+            try:
+                event = decode(message)
+            except msgspec.DecodeError:
+                # Malformed JSON or an out-of-range column.
+                event = None
+            if not isinstance(event, PlayCommand):
+                await error(websocket, "Invalid message.")
+                continue
+            column = event.column
 
         try:
             # Play the move on the python side
-            row = game.play(player, column)
+            row = play_move(player, column)
         except ValueError as e:
             # Send an "error" event if the move was illegal.
             await error(websocket, str(e))  
             continue
 
-        # Set your event fields
-        event['type'] = 'play'
-        event['player'] = player
-        event['row'] = row
-
-        # Send the "play event" to UI using websockets broadcast
-        ws_broadcast(connected, json.dumps(event))
+        # Send the "play event" to UI. The frame is prebuilt and the same
+        # bytes go out to every connection.
+        fanout(room, frames[column][row])
 
         # If the last move won
         if game.winner is not None:
-            event = {
-                "type": "win",
-                "player": game.winner,
-            }
-            ws_broadcast(connected, json.dumps(event))
+            fanout(room, _WIN_FRAMES[game.winner])
 
 
 async def handler(websocket):
     # Receive and parse the "init" event from the UI.
-    message = await websocket.recv()
-    event = json.loads(message)
-    assert event["type"] == "init"
-
-    if "join" in event:
-        # second player joins existing game.
-        await join(websocket, event['join'])
-    elif "watch" in event:
-        await watch(websocket, event['watch'])
-    else:
+    message = await websocket.recv(decode=False)
+    try:
+        event = _DECODER.decode(message)
+    except msgspec.DecodeError:
+        event = None
+    if not isinstance(event, InitCommand):
+        await error(websocket, "Invalid message.")
+        return
+
+    token = event.join if event.join is not None else event.watch
+    if token is None:
         # First player starts a new game
         await start(websocket)
+        return
+
+    # Find the Connect Four game. The token alone decides whether the
+    # connection joins as the second player or watches.
+    room, role = ROOMS.get(token, (None, None))
+    if role == ROLE_PLAYER:
+        await join(websocket, room)
+    elif role == ROLE_SPECTATOR:
+        await watch(websocket, room)
+    else:
+        owner = _token_owner(token)
+        if owner is None:
+            await error(websocket, "Game not found")
+        else:
+            # The game lives in another process; pass the connection through.
+            await relay(websocket, owner, message)
+
+
+# Static files served over HTTP, keyed by request path.
+STATIC_FILES = {
+    "/": ("index.html", "text/html"),
+    "/main.js": ("main.js", "text/javascript"),
+    "/connect4.js": ("connect4.js", "text/javascript"),
+    "/connect4.css": ("connect4.css", "text/css"),
+}
+
+
+# Content codings we precompress static files with, in order of preference.
+STATIC_ENCODINGS = {
+    "br": lambda body: brotli.compress(body, quality=11),
+    "gzip": lambda body: gzip.compress(body, compresslevel=9),
+}
+
+
+def _load_static_files():
+    """Read every static file once and build a (status, headers, body) tuple per encoding"""
+    base_dir = Path(__file__).parent
+    cache = {}
+    for path, (filename, content_type) in STATIC_FILES.items():
+        body = (base_dir / filename).read_bytes()
+        variants = {None: body}
+        for encoding, compress in STATIC_ENCODINGS.items():
+            variants[encoding] = compress(body)
+        responses = {}
+        for encoding, data in variants.items():
+            headers = [
+                ("Content-Type", content_type),
+                ("Content-Length", str(len(data))),
+                ("Vary", "Accept-Encoding"),
+            ]
+            if encoding is not None:
+                headers.append(("Content-Encoding", encoding))
+            responses[encoding] = (http.HTTPStatus.OK, headers, data)
+        cache[path] = responses
+    # An empty path is the root page too.
+    cache[""] = cache["/"]
+    return cache
+
+
+def _accepted_encodings(accept_encoding):
+    """Return the set of content codings a client accepts"""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        if params in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    return accepted
+
+
+# The files don't change while the server runs, so keep them in memory.
+_STATIC_CACHE = _load_static_files()
+_NOT_FOUND = (
+    http.HTTPStatus.NOT_FOUND,
+    [("Content-Type", "text/plain"), ("Content-Length", "9")],
+    b"Not Found",
+)
 
 
 def process_request(connection, request):
     """Handle HTTP requests for static files"""
-    base_dir = Path(__file__).parent
-    
-    # Extract path from request object and strip query string
-    path = request.path
-    # Remove query string if present (e.g., "/?join=abc" -> "/")
-    if '?' in path:
-        path = path.split('?')[0]
-    
     # Check if this is a WebSocket upgrade request - if so, let websockets handle it
     # WebSocket upgrade requests have "Upgrade: websocket" header
     upgrade_header = request.headers.get("upgrade", "")
     if upgrade_header and "websocket" in upgrade_header.lower():
         return None  # Let websockets library handle the upgrade
     
-    # Log the path for debugging
-    logging.info(f"HTTP request path: {request.path} -> normalized: {path}")
-    
-    # Serve index.html for root path
-    if path == '/' or path == '':
-        html_path = base_dir / "index.html"
-        if html_path.exists():
-            content = html_path.read_bytes()
-            return Response(
-                status_code=200,
-                reason_phrase="OK",
-                headers=Headers([("Content-Type", "text/html")]),
-                body=content
-            )
-        else:
-            # Return 404 if index.html doesn't exist
-            return Response(
-                status_code=404,
-                reason_phrase="Not Found",
-                headers=Headers([("Content-Type", "text/plain")]),
-                body=b"Not Found"
-            )
-    
-    # Remove leading slash for file lookup
-    filename = path.lstrip('/')
-    
-    # Only serve .js and .css files for security
-    if not (filename.endswith('.js') or filename.endswith('.css')):
-        # Return 404 for non-JS/CSS files
-        return Response(
-            status_code=404,
-            reason_phrase="Not Found",
-            headers=Headers([("Content-Type", "text/plain")]),
-            body=b"Not Found"
-        )
-    
-    file_path = base_dir / filename
-    
-    if not file_path.exists() or not file_path.is_file():
-        # Return 404 if file doesn't exist
-        return Response(
-            status_code=404,
-            reason_phrase="Not Found",
-            headers=Headers([("Content-Type", "text/plain")]),
-            body=b"Not Found"
-        )
+    # Extract path from request object and strip query string
+    # (e.g., "/?join=abc" -> "/"). Static paths are plain ASCII, so anything
+    # percent-encoded simply misses the cache and gets a 404.
+    path = request.path
+    query = path.find('?')
+    if query >= 0:
+        path = path[:query]
     
-    # Set appropriate content type
-    content_type = "text/javascript" if filename.endswith(".js") else "text/css"
+    # Log the path for debugging
+    logging.info("HTTP request path: %s -> normalized: %s", request.path, path)
     
+    responses = _STATIC_CACHE.get(path)
+    if responses is None:
+        status, headers, body = _NOT_FOUND
+    else:
+        # Pick the best precompressed variant the client accepts.
+        accepted = _accepted_encodings(request.headers.get("Accept-Encoding", ""))
+        encoding = next((e for e in STATIC_ENCODINGS if e in accepted), None)
+        status, headers, body = responses[encoding]
+    # Response headers get mutated by websockets (it adds "Server"), so build
+    # a fresh Response around the cached values for every request.
     return Response(
-        status_code=200,
-        reason_phrase="OK",
-        headers=Headers([("Content-Type", content_type)]),
-        body=file_path.read_bytes()
+        status_code=status.value,
+        reason_phrase=status.phrase,
+        headers=Headers(headers),
+        body=body
     )
 
 
@@ -241,13 +478,60 @@ async def main():
             "0.0.0.0", 
             port, 
             process_request=process_request,
+            # Browser messages are a few dozen bytes, so don't buffer up to 1 MiB
+            max_size=2**14,
+            # Let every worker process bind the same port
+            reuse_port=WORKERS > 1,
             # Suppress errors from connections that close immediately
             logger=logging.getLogger("websockets")
-        ) as server:
-            print(f'Server started on port {port}')
+        ) as server, contextlib.AsyncExitStack() as stack:
+            if WORKERS > 1:
+                # Other workers forward connections for this worker's games here.
+                await stack.enter_async_context(unix_serve(
+                    handler,
+                    _worker_socket(WORKER_ID),
+                    compression=None,
+                    max_size=2**14,
+                    logger=logging.getLogger("websockets")
+                ))
+            print(f'Worker {WORKER_ID} started on port {port}')
             await server.serve_forever()
     except asyncio.CancelledError:
         print('Context cancelled, shutting down gracefully...')
 
+def run_worker(worker_id, socket_dir=None):
+    global WORKER_ID, SOCKET_DIR
+    WORKER_ID = worker_id
+    SOCKET_DIR = socket_dir
+    # Run on uvloop's libuv-based event loop instead of the default asyncio one.
+    uvloop.run(main())
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WORKERS == 1:
+        run_worker(0)
+    else:
+        # One process per worker; the kernel spreads incoming connections
+        # across them.
+        socket_dir = tempfile.mkdtemp(prefix="connect4-")
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(worker_id, socket_dir))
+            for worker_id in range(WORKERS)
+        ]
+        for worker in workers:
+            worker.start()
+
+        def stop_workers(signum, frame):
+            # Pass a shutdown request (Heroku sends SIGTERM) on to the workers.
+            for worker in workers:
+                worker.terminate()
+
+        signal.signal(signal.SIGTERM, stop_workers)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # Ctrl-C reaches the workers too; wait for them to exit.
+            for worker in workers:
+                worker.join()
+        finally:
+            shutil.rmtree(socket_dir, ignore_errors=True)
@@ -18,6 +18,9 @@ class Connect4:
     def __init__(self):
         self.moves = []
         self.top = [0 for _ in range(7)]
+        # One bitboard per player: bit 8 * column + row is set for each of
+        # their checkers. Rows 6 and 7 stay empty so lines can't wrap around.
+        self.boards = {PLAYER1: 0, PLAYER2: 0}
         self.winner = None
 
     @property
@@ -34,8 +37,16 @@ class Connect4:
         Whether the last move is winning.
 
         """
-        b = sum(1 << (8 * column + row) for _, column, row in self.moves[::-2])
-        return any(b & b >> v & b >> 2 * v & b >> 3 * v for v in [1, 7, 8, 9])
+        b = self.boards[self.last_player]
+        # Four in a row along a direction v: pair up neighbours with b & b >> v,
+        # then pair up the pairs. Directions are vertical (1), anti-diagonal (7),
+        # horizontal (8) and diagonal (9).
+        return bool(
+            (m := b & b >> 1) & m >> 2
+            or (m := b & b >> 7) & m >> 14
+            or (m := b & b >> 8) & m >> 16
+            or (m := b & b >> 9) & m >> 18
+        )
 
     def play(self, player, column):
         """
@@ -46,6 +57,9 @@ class Connect4:
         Raises :exc:`ValueError` if the move is illegal.
 
         """
+        if player not in self.boards:
+            raise ValueError(f"player must be {PLAYER1} or {PLAYER2}.")
+
         if player == self.last_player:
             raise ValueError("It isn't your turn.")
 
@@ -55,6 +69,7 @@ class Connect4:
 
         self.moves.append((player, column, row))
         self.top[column] += 1
+        self.boards[player] |= 1 << (8 * column + row)
 
         if self.winner is None and self.last_player_won:
             self.winner = self.last_player
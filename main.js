@@ -1,4 +1,4 @@
-import { createBoard, playMove } from "./connect4.js";
+import { PLAYER1, PLAYER2, createBoard, playMove } from "./connect4.js";
 
 function initGame(websocket) {
     websocket.addEventListener("open", () => {
@@ -22,12 +22,26 @@ function showMessage(message) {
     window.setTimeout(() => window.alert(message), 50);
 }
 
+// Events arrive as binary frames starting with a one-byte tag (see app.py).
+const TAG_PLAY = 1;
+const TAG_WIN = 2;
+const TAG_ERROR = 3;
+const TAG_INIT = 4;
+
+const PLAYERS = [undefined, PLAYER1, PLAYER2];
+
 function receiveMoves(board, websocket) {
+    // Errors and the init event carry a JSON object after the tag.
+    const decoder = new TextDecoder();
+    const decodeJSON = (data) => JSON.parse(decoder.decode(new Uint8Array(data, 1)));
+    websocket.binaryType = "arraybuffer";
     websocket.addEventListener("message", ({ data }) => {
-        const event = JSON.parse(data);
-        switch (event.type) {
-        case "init":
+        const view = new DataView(data);
+        const tag = view.getUint8(0);
+        switch (tag) {
+        case TAG_INIT:
             // Create links for inviting the second player and spectators.
+            const event = decodeJSON(data);
             const joinLink = document.querySelector(".join");
             const watchLink = document.querySelector(".watch");
             if (joinLink && event.join) {
@@ -37,20 +51,27 @@ function receiveMoves(board, websocket) {
                 watchLink.href = "/?watch=" + event.watch;
             }
             break;
-        case "play":
-            // Update the UI with the move.
-            playMove(board, event.player, event.column, event.row);
+        case TAG_PLAY:
+            // Update the UI with the move. Replays pack several moves in a frame.
+            for (let offset = 0; offset < view.byteLength; offset += 4) {
+                playMove(
+                    board,
+                    PLAYERS[view.getUint8(offset + 1)],
+                    view.getUint8(offset + 2),
+                    view.getUint8(offset + 3),
+                );
+            }
             break;
-        case "win":
-            showMessage(`Player ${event.player} wins!`);
+        case TAG_WIN:
+            showMessage(`Player ${PLAYERS[view.getUint8(1)]} wins!`);
             // No further messages are expected; close the WebSocket connection.
             websocket.close(1000);
             break;
-        case "error":
-            showMessage(event.message);
+        case TAG_ERROR:
+            showMessage(decodeJSON(data).message);
             break;
         default:
-            throw new Error(`Unsupported event type: ${event.type}.`);
+            throw new Error(`Unsupported event tag: ${tag}.`);
         }
     });
     }